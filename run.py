@@ -1,671 +1,849 @@
-import os
-import subprocess
-import threading
-import time
-import math
-import tempfile
-import shutil
-import glob
-import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# -------------------- CONFIGURATION VARIABLES --------------------
-# Those settings are set to my machine and to process very low res video. (about 640x480),
-# Using the settings below I get about 20 fps at this resolution using about 8gb of VRAM.
-# So you may want to play with the settings to find the sweet spot to your system.
-# For comparison basis, my system:
-# Ryzen 9 5950x
-# 64gb 3200 MT/s
-# RTX 3060 12gb (It's mostly bottle necked by GPU)
-# Windows 11 Pro Version 24H2 Build 26100.3194
-
-MAX_CONCURRENT_BATCHES = 5  # Number of batches processed concurrently.
-# Depending on your system and your input video resolution, you may wanna lower this value.
-
-MODEL_NAME = "realesr-animevideov3-x2"  # Upscaler model to use with RealESRGAN.
-# If you change from x2 to 3x or 4x,
-# also change the ESRGAN_SCALE variable to
-# match the scale with the model.
-
-STAGGER_DELAY = 10  # Delay in seconds between starting each batch's extraction and processing.
-# The sweet spot here is somewhere between when a batch is close to finishing;
-# This helps smoothing GPU usage and to not cause a surge in system use.
-# To higher res you should increase this value to something about 15-30
-# depending on your BATCH_SIZE variable.
-
-BATCH_SIZE = 20 # Batch size (in seconds). 0 = processes the whole video in one batch.
-# Note that if set to 0, the concurrent batches will only be one,
-# also if set to 0, make sure you have enough disk space since it'll
-# extract all the video frames before starts processing.
-# keeping it small it'll extract only what you defined at a time,
-# ideal if you don't have much space. Also if you set too large and
-# the video is short, it may not have enough batches to be processed
-# concurrently by the set value in concurrent batches...
-
-FINAL_FILE_FORMAT_OVERRIDE = "false" # Overrides final output file format.
-# Set to ".mp4" or any other file format to force that format,
-# or set to "false" to use the input file's format.
-
-# Variables for ESRGAN options:
-ESRGAN_SCALE = "2"  # Value for the -s option (scale)
-# This value must match the model upscaler multiplier
-# otherwise esrgan will assemble the video incorrectly.
-
-ESRGAN_TILE = "1920"  # Value for the -t option (tile size in esrgan)
-# Decrease this value to a divisible integer of the video resolution you're inputting
-# if you have problems with VRAM.
-
-ESRGAN_EXTRA_ARGS = ""  # Additional ESRGAN arguments.
-# Only put add something here if you know what you're doing.
-
-FFMPEG_REASSEMBLY_ARGS = "-c:v libx264 -pix_fmt yuv420p"  # Variable for ffmpeg arguments
-# Arguments for the final video encoding with ffmpeg.
-# Maybe you should leave as default if you don't know what you're doing.
-
-# ------------------------------------------------------------------
-
-def is_integer_fps(fps: float, tol: float = 1e-6) -> bool:
-    """Return True if 'fps' is within a small tolerance of an integer."""
-    return abs(fps - round(fps)) < tol
-
-
-def convert_if_needed(video_file, fps, script_dir):
-    """
-    If the video is already integer fps AND in MP4 format, skip conversion.
-    If fps is integer but container is not MP4, remux with -c copy (no re-encode).
-    Otherwise, re-encode to MP4 with forced integer fps.
-    Returns the path to the resulting file.
-    """
-    base_name = os.path.splitext(os.path.basename(video_file))[0]
-    input_ext = os.path.splitext(video_file)[1].lower()
-    output_fps = int(round(fps))
-    temp_dir = tempfile.gettempdir()
-    converted_path = os.path.join(temp_dir, base_name + "_converted.mp4")
-
-    if is_integer_fps(fps) and input_ext == ".mp4":
-        print(f"Skipping conversion (integer fps & already MP4): {video_file}")
-        return video_file
-
-    if is_integer_fps(fps):
-        if input_ext != ".mp4":
-            print(f"Remuxing from {input_ext} to .mp4 (no re-encode).")
-            cmd_remux = [
-                "ffmpeg",
-                "-hide_banner", "-loglevel", "error",
-                "-y",
-                "-i", video_file,
-                "-c", "copy",
-                converted_path
-            ]
-            subprocess.run(cmd_remux, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return converted_path
-        else:
-            return video_file
-    else:
-        print(f"Re-encoding {video_file} to MP4 with fps={output_fps}")
-        cmd_encode = [
-            "ffmpeg",
-            "-hide_banner", "-loglevel", "error",
-            "-y",
-            "-i", video_file,
-            "-r", str(output_fps),
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "18",
-            converted_path
-        ]
-        subprocess.run(cmd_encode, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return converted_path
-
-
-def get_video_info(video_file):
-    """
-    Uses ffprobe to get average frame rate, duration, and time_base.
-    Returns (fps, duration, time_base).
-    Falls back to format metadata if needed.
-    """
-    try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=avg_frame_rate,duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            video_file
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        lines = result.stdout.splitlines()
-        if len(lines) < 2:
-            raise ValueError("ffprobe output incomplete.")
-        fps_str = lines[0].strip()
-        duration_str = lines[1].strip()
-
-        if duration_str == "N/A":
-            cmd_format = [
-                "ffprobe", "-v", "error",
-                "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                video_file
-            ]
-            result_format = subprocess.run(cmd_format, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
-                                           check=True)
-            duration_str = result_format.stdout.strip()
-
-        if '/' in fps_str:
-            num, den = fps_str.split('/')
-            fps = float(num) / float(den)
-        else:
-            fps = float(fps_str)
-        duration = float(duration_str)
-
-        cmd_tb = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=time_base",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            video_file
-        ]
-        result_tb = subprocess.run(cmd_tb, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        time_base_str = result_tb.stdout.strip()
-        if '/' in time_base_str:
-            num_tb, den_tb = time_base_str.split('/')
-            time_base = float(num_tb) / float(den_tb)
-        else:
-            time_base = float(time_base_str)
-        return fps, duration, time_base
-    except Exception as e:
-        print(f"Error getting video info for {video_file}: {e}")
-        return 24.0, 0.0, 1.0 / 1000
-
-
-def process_batch(video_file, batch_index, start_time, duration, output_fps, time_base, script_dir, ffmpeg_extra_args,
-                  update_progress):
-    """
-    Processes a single batch:
-      - Extracts frames from the converted video at output_fps into one folder.
-      - If too few frames are extracted, creates a placeholder segment.
-      - Otherwise, starts a polling thread to update progress while calling RealESRGAN once on the folder.
-      - Reassembles the processed frames into a video segment using a concat file.
-    Returns the path to the segment.
-    """
-    temp_dir = tempfile.gettempdir()
-    base_name = os.path.splitext(os.path.basename(video_file))[0]
-    batch_id = f"{base_name}_batch_{batch_index}_{int(time.time())}"
-    extraction_dir = os.path.join(temp_dir, batch_id + "_extraction")
-    processed_dir = os.path.join(temp_dir, batch_id + "_processed")
-    os.makedirs(extraction_dir, exist_ok=True)
-    os.makedirs(processed_dir, exist_ok=True)
-
-    # Extraction Phase
-    cmd_extract = [
-        "ffmpeg",
-        "-hide_banner", "-loglevel", "error",
-        "-ss", str(start_time),
-        "-t", str(duration),
-        "-y",
-        "-i", video_file,
-        "-r", str(output_fps),
-        os.path.join(extraction_dir, "frame_%06d.png")
-    ]
-    try:
-        subprocess.run(cmd_extract, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        print(f"Error extracting frames for batch {batch_index}: {e}")
-    time.sleep(2)
-
-    extracted_frames = glob.glob(os.path.join(extraction_dir, "frame_*.png"))
-    if len(extracted_frames) < 2:
-        print(f"Batch {batch_index}: too few extracted frames ({len(extracted_frames)}). Creating placeholder segment.")
-        placeholder_segment = os.path.join(temp_dir, batch_id + "_placeholder.mp4")
-        cmd_placeholder = [
-            "ffmpeg",
-            "-hide_banner", "-loglevel", "error",
-            "-y",
-            "-f", "lavfi",
-            "-i", f"color=c=black:s=1280x720:d={duration}",
-            "-r", str(output_fps),
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            placeholder_segment
-        ]
-        try:
-            subprocess.run(cmd_placeholder, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            shutil.rmtree(extraction_dir, ignore_errors=True)
-            shutil.rmtree(processed_dir, ignore_errors=True)
-            update_progress(len(extracted_frames))
-            return placeholder_segment
-        except subprocess.CalledProcessError as e:
-            print(f"Error generating placeholder segment for batch {batch_index}: {e}")
-            return None
-
-    # Processing Phase
-    progress_event = threading.Event()
-
-    def poll_progress():
-        last_count = 0
-        while not progress_event.is_set():
-            current_count = len(glob.glob(os.path.join(processed_dir, "frame_*.png")))
-            if current_count > last_count:
-                delta = current_count - last_count
-                update_progress(delta)
-                last_count = current_count
-            time.sleep(0.5)
-
-    poll_thread = threading.Thread(target=poll_progress)
-    poll_thread.start()
-
-    realesrgan_bin = os.path.join(script_dir, "bin", "realesrgan-ncnn-vulkan")
-    # Build ESRGAN command with configurable options:
-    cmd_esrgan = [
-        realesrgan_bin,
-        "-i", extraction_dir,
-        "-o", processed_dir,
-        "-n", MODEL_NAME,
-        "-s", ESRGAN_SCALE,
-        "-t", ESRGAN_TILE
-    ]
-    if ESRGAN_EXTRA_ARGS.strip() != "":
-        cmd_esrgan.extend(ESRGAN_EXTRA_ARGS.strip().split())
-    ESRGAN_TIMEOUT = 600 # Timeout in case some ESRGAN instance staggers.
-    max_attempts = 3
-    attempt = 0
-    success = False
-    while attempt < max_attempts and not success:
-        try:
-            subprocess.run(cmd_esrgan, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                           timeout=ESRGAN_TIMEOUT)
-            success = True
-        except subprocess.TimeoutExpired as e:
-            attempt += 1
-            print(
-                f"Timeout: RealESRGAN for batch {batch_index} didn't finish in {ESRGAN_TIMEOUT}s, attempt {attempt}. Retrying...")
-            time.sleep(5)
-        except subprocess.CalledProcessError as e:
-            attempt += 1
-            print(f"Error processing frames with RealESRGAN for batch {batch_index}, attempt {attempt}: {e}")
-            time.sleep(5)
-    progress_event.set()
-    poll_thread.join()
-
-    if not success:
-        print(f"RealESRGAN failed for batch {batch_index} after {max_attempts} attempts. Creating placeholder segment.")
-        placeholder_segment = os.path.join(temp_dir, batch_id + "_placeholder.mp4")
-        cmd_placeholder = [
-            "ffmpeg",
-            "-hide_banner", "-loglevel", "error",
-            "-y",
-            "-f", "lavfi",
-            "-i", f"color=c=black:s=1280x720:d={duration}",
-            "-r", str(output_fps),
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            placeholder_segment
-        ]
-        try:
-            subprocess.run(cmd_placeholder, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            shutil.rmtree(extraction_dir, ignore_errors=True)
-            shutil.rmtree(processed_dir, ignore_errors=True)
-            return placeholder_segment
-        except subprocess.CalledProcessError as e:
-            print(f"Error generating placeholder segment for batch {batch_index}: {e}")
-            return None
-
-    # Reassembly Phase
-    if MAX_CONCURRENT_BATCHES == 1:
-        # In single batch mode, decouple reassembly into a separate thread to avoid GPU idle time.
-        # Move the processed frames to a separate folder for reassembly.
-        reassembly_dir = processed_dir + "_for_reassembly"
-        shutil.move(processed_dir, reassembly_dir)
-        def do_reassembly():
-            frame_files = sorted(glob.glob(os.path.join(reassembly_dir, "frame_*.png")))
-            if not frame_files:
-                print(f"No processed frames found for batch {batch_index}. Creating a placeholder segment.")
-                placeholder_segment = os.path.join(temp_dir, batch_id + "_placeholder.mp4")
-                cmd_placeholder = [
-                    "ffmpeg",
-                    "-hide_banner", "-loglevel", "error",
-                    "-y",
-                    "-f", "lavfi",
-                    "-i", f"color=c=black:s=1280x720:d={duration}",
-                    "-r", str(output_fps),
-                    "-c:v", "libx264",
-                    "-pix_fmt", "yuv420p",
-                    placeholder_segment
-                ]
-                try:
-                    subprocess.run(cmd_placeholder, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    return placeholder_segment
-                except subprocess.CalledProcessError as e:
-                    print(f"Error generating placeholder segment for batch {batch_index}: {e}")
-                    return None
-            frames = []
-            for filepath in frame_files:
-                filename = os.path.basename(filepath)
-                try:
-                    frame_num = int(filename.split("frame_")[1].split(".png")[0])
-                    timestamp = (frame_num - 1) / output_fps
-                    frames.append((filepath, timestamp))
-                except Exception as e:
-                    print(f"Error parsing frame index from {filename}: {e}")
-            frames.sort(key=lambda x: x[1])
-            concat_list_path = os.path.join(temp_dir, batch_id + "_frames.txt")
-            with open(concat_list_path, "w", encoding="utf-8") as f:
-                f.write("ffconcat version 1.0\n")
-                for i, (filepath, timestamp) in enumerate(frames):
-                    if i < len(frames) - 1:
-                        duration_sec = 1.0 / output_fps
-                        f.write(f"file '{filepath.replace('\\', '\\\\')}'\n")
-                        f.write(f"duration {duration_sec:.6f}\n")
-                    else:
-                        f.write(f"file '{filepath.replace('\\', '\\\\')}'\n")
-                        f.write("duration 0.000000\n")
-            segment_output = os.path.join(temp_dir, batch_id + "_segment.mp4")
-            cmd_concat = [
-                "ffmpeg",
-                "-hide_banner", "-loglevel", "error",
-                "-f", "concat",
-                "-safe", "0",
-                "-i", concat_list_path,
-                "-r", str(output_fps)
-            ]
-            if FFMPEG_REASSEMBLY_ARGS.strip() != "":
-                cmd_concat.extend(FFMPEG_REASSEMBLY_ARGS.strip().split())
-            cmd_concat.extend(["-y", "-c:v", "libx264", "-pix_fmt", "yuv420p", segment_output])
-            try:
-                subprocess.run(cmd_concat, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            except subprocess.CalledProcessError as e:
-                print(f"Error reassembling video segment for batch {batch_index}: {e}")
-            if os.path.exists(concat_list_path):
-                os.remove(concat_list_path)
-            shutil.rmtree(reassembly_dir, ignore_errors=True)
-            return segment_output
-        result_container = [None]
-        reassembly_thread = threading.Thread(target=lambda: result_container.__setitem__(0, do_reassembly()))
-        reassembly_thread.start()
-        shutil.rmtree(extraction_dir, ignore_errors=True)
-        # Return a tuple containing the result container and the reassembly thread.
-        return (result_container, reassembly_thread)
-    else:
-        # Original reassembly Phase code.
-        frame_files = sorted(glob.glob(os.path.join(processed_dir, "frame_*.png")))
-        if not frame_files:
-            print(f"No processed frames found for batch {batch_index}. Creating a placeholder segment.")
-            placeholder_segment = os.path.join(temp_dir, batch_id + "_placeholder.mp4")
-            cmd_placeholder = [
-                "ffmpeg",
-                "-hide_banner", "-loglevel", "error",
-                "-y",
-                "-f", "lavfi",
-                "-i", f"color=c=black:s=1280x720:d={duration}",
-                "-r", str(output_fps),
-                "-c:v", "libx264",
-                "-pix_fmt", "yuv420p",
-                placeholder_segment
-            ]
-            try:
-                subprocess.run(cmd_placeholder, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                shutil.rmtree(extraction_dir, ignore_errors=True)
-                shutil.rmtree(processed_dir, ignore_errors=True)
-                update_progress(len(extracted_frames))
-                return placeholder_segment
-            except subprocess.CalledProcessError as e:
-                print(f"Error generating placeholder segment for batch {batch_index}: {e}")
-                return None
-        frames = []
-        for filepath in frame_files:
-            filename = os.path.basename(filepath)
-            try:
-                frame_num = int(filename.split("frame_")[1].split(".png")[0])
-                timestamp = (frame_num - 1) / output_fps
-                frames.append((filepath, timestamp))
-            except Exception as e:
-                print(f"Error parsing frame index from {filename}: {e}")
-        frames.sort(key=lambda x: x[1])
-        concat_list_path = os.path.join(temp_dir, batch_id + "_frames.txt")
-        with open(concat_list_path, "w", encoding="utf-8") as f:
-            f.write("ffconcat version 1.0\n")
-            for i, (filepath, timestamp) in enumerate(frames):
-                if i < len(frames) - 1:
-                    duration_sec = 1.0 / output_fps
-                    f.write(f"file '{filepath.replace('\\', '\\\\')}'\n")
-                    f.write(f"duration {duration_sec:.6f}\n")
-                else:
-                    f.write(f"file '{filepath.replace('\\', '\\\\')}'\n")
-                    f.write("duration 0.000000\n")
-        segment_output = os.path.join(temp_dir, batch_id + "_segment.mp4")
-        cmd_concat = [
-            "ffmpeg",
-            "-hide_banner", "-loglevel", "error",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_list_path,
-            "-r", str(output_fps)
-        ]
-        if FFMPEG_REASSEMBLY_ARGS.strip() != "":
-            cmd_concat.extend(FFMPEG_REASSEMBLY_ARGS.strip().split())
-        cmd_concat.extend(["-y", segment_output])
-        try:
-            subprocess.run(cmd_concat, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError as e:
-            print(f"Error reassembling video segment for batch {batch_index}: {e}")
-        if os.path.exists(concat_list_path):
-            os.remove(concat_list_path)
-        shutil.rmtree(extraction_dir, ignore_errors=True)
-        shutil.rmtree(processed_dir, ignore_errors=True)
-        return segment_output
-
-
-def process_video(video_file, script_dir, ffmpeg_extra_args, video_index, total_videos):
-    """
-    Processes a single video:
-      1. Converts the video only if needed (or remuxes) to MP4 with normalized fps.
-      2. Splits the resulting video into batches (in seconds defined by BATCH_SIZE; 0 means all at once).
-      3. Processes each batch concurrently.
-      4. Concatenates the batches and merges with the original audio.
-      5. Final output uses the override format if specified, otherwise the input file format.
-    """
-    print(f"\nProcessing video: {video_file}")
-    fps, duration, time_base = get_video_info(video_file)
-    if duration <= 0:
-        print(f"Skipping {video_file} due to zero duration.")
-        return
-
-    video_start_time = time.time()
-
-    # Convert or remux only if needed.
-    converted_video = convert_if_needed(video_file, fps, script_dir)
-
-    output_fps = int(round(fps))
-    total_frames = int(math.ceil(duration * output_fps))
-    if BATCH_SIZE == 0:
-        batch_duration = duration
-        num_batches = 1
-    else:
-        batch_duration = BATCH_SIZE
-        num_batches = math.ceil(duration / BATCH_SIZE)
-
-    progress_lock = threading.Lock()
-    frames_processed = [0]
-    batches_completed = [0]
-    start_time_progress = time.time()
-    progress_done = threading.Event()
-
-    def update_progress(delta):
-        with progress_lock:
-            frames_processed[0] += delta
-
-    def progress_bar():
-        while not progress_done.is_set():
-            with progress_lock:
-                current = frames_processed[0]
-                batches = batches_completed[0]
-            elapsed = time.time() - start_time_progress
-            proc_fps = current / elapsed if elapsed > 0 else 0
-            percentage = (current / total_frames) * 100
-            remaining_frames = total_frames - current
-            eta_minutes = (remaining_frames / proc_fps) / 60 if proc_fps > 0 else float('inf')
-            print(
-                f"\rVideo {video_index}/{total_videos} | Batches: {batches}/{num_batches} | Progress: {percentage:6.2f}% ({current}/{total_frames} frames) | Speed: {proc_fps:6.2f} fps | ETA: {eta_minutes:6.1f} min",
-                end='', flush=True)
-            time.sleep(1)
-        with progress_lock:
-            current = frames_processed[0]
-            batches = batches_completed[0]
-        elapsed = time.time() - start_time_progress
-        proc_fps = current / elapsed if elapsed > 0 else 0
-        percentage = (current / total_frames) * 100
-        print(
-            f"\rVideo {video_index}/{total_videos} | Batches: {batches}/{num_batches} | Progress: {percentage:6.2f}% ({current}/{total_frames} frames) | Speed: {proc_fps:6.2f} fps | ETA: 0.0 min",
-            flush=True)
-
-    progress_thread = threading.Thread(target=progress_bar)
-    progress_thread.start()
-
-    segment_files = [None] * num_batches
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as executor:
-        future_to_index = {}
-        for batch_index in range(num_batches):
-            time.sleep(STAGGER_DELAY)  # Stagger batch extraction start.
-            start_time_batch = batch_index * batch_duration
-            current_duration = min(batch_duration, duration - start_time_batch)
-            future = executor.submit(
-                process_batch,
-                converted_video,
-                batch_index,
-                start_time_batch,
-                current_duration,
-                output_fps,
-                time_base,
-                script_dir,
-                ffmpeg_extra_args,
-                update_progress
-            )
-            future_to_index[future] = batch_index
-        for future in as_completed(future_to_index):
-            batch_index = future_to_index[future]
-            try:
-                result = future.result()
-                segment_files[batch_index] = result
-                with progress_lock:
-                    batches_completed[0] += 1
-            except Exception as exc:
-                print(f"\nBatch {batch_index + 1} generated an exception: {exc}")
-
-    progress_done.set()
-    progress_thread.join()
-
-    # If any batch returned a tuple (due to decoupled reassembly), join the thread to get the segment output.
-    for i, seg in enumerate(segment_files):
-        if isinstance(seg, tuple):
-            result_container, reassembly_thread = seg
-            reassembly_thread.join()
-            segment_files[i] = result_container[0]
-
-    if converted_video != video_file and os.path.exists(converted_video):
-        os.remove(converted_video)
-
-    # Concatenate segments.
-    temp_dir = tempfile.gettempdir()
-    concat_list_file = os.path.join(temp_dir, f"{os.path.splitext(os.path.basename(video_file))[0]}_segments.txt")
-    with open(concat_list_file, "w", encoding="utf-8") as f:
-        for seg in segment_files:
-            if seg is not None:
-                f.write(f"file '{seg.replace('\\', '\\\\')}'\n")
-            else:
-                print("Warning: A batch segment is missing and will be skipped.")
-    video_no_audio = os.path.join(temp_dir, f"{os.path.splitext(os.path.basename(video_file))[0]}_no_audio.mp4")
-    cmd_concat = [
-        "ffmpeg",
-        "-hide_banner", "-loglevel", "error",
-        "-f", "concat",
-        "-safe", "0",
-        "-y",
-        "-i", concat_list_file,
-        "-c", "copy",
-        video_no_audio
-    ]
-    try:
-        subprocess.run(cmd_concat, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        print(f"Error concatenating video segments: {e}")
-        return
-
-    # Determine final output file format.
-    if FINAL_FILE_FORMAT_OVERRIDE.lower() != "false":
-        final_ext = FINAL_FILE_FORMAT_OVERRIDE
-    else:
-        final_ext = os.path.splitext(video_file)[1]
-
-    output_dir = os.path.join(script_dir, "output")
-    os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(video_file))[0] + final_ext)
-    cmd_merge = [
-        "ffmpeg",
-        "-hide_banner", "-loglevel", "error",
-        "-y",
-        "-i", video_no_audio,
-        "-i", video_file,
-        "-map", "0:v",
-        "-map", "1:a",
-        "-c", "copy",
-        "-map_metadata", "1",
-        output_file
-    ]
-    try:
-        subprocess.run(cmd_merge, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        print(f"Error merging audio and video: {e}")
-        return
-
-    for seg in segment_files:
-        if seg and os.path.exists(seg):
-            os.remove(seg)
-    if os.path.exists(concat_list_file):
-        os.remove(concat_list_file)
-    if os.path.exists(video_no_audio):
-        os.remove(video_no_audio)
-
-    video_elapsed = time.time() - video_start_time
-    minutes = int(video_elapsed // 60)
-    seconds = video_elapsed % 60
-    print(f"\nFinished processing {video_file}. Output saved to {output_file}")
-    print(f"Elapsed time for this video: {minutes} min {seconds:4.1f} sec\n")
-    return video_elapsed
-
-
-def main():
-    print("Script started!")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    input_dir = os.path.join(script_dir, "input")
-    print(f"Looking for videos in: {input_dir}")
-    ffmpeg_extra_args = []  # Extra ffmpeg arguments if needed.
-
-    video_files = []
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            video_files.append(os.path.join(root, file))
-    total_videos = len(video_files)
-    if total_videos == 0:
-        print("No video files found in input folder.")
-        return
-
-    total_elapsed = 0
-    processed_videos = 0
-    for i, video_path in enumerate(video_files, start=1):
-        print(f"\n--- Processing video {i}/{total_videos} ---")
-        elapsed = process_video(video_path, script_dir, ffmpeg_extra_args, i, total_videos)
-        if elapsed is not None:
-            processed_videos += 1
-            total_elapsed += elapsed
-            print(f"Global progress: {processed_videos}/{total_videos} videos processed.")
-    if processed_videos > 0:
-        total_minutes = int(total_elapsed // 60)
-        total_seconds = total_elapsed % 60
-        print(f"\nTotal elapsed time for all videos: {total_minutes} min {total_seconds:4.1f} sec")
-    else:
-        print("No videos were processed.")
-
-
-if __name__ == "__main__":
-    print("Running script...")
-    main()
-    print("Script completed!")
+import json
+import os
+import subprocess
+import threading
+import time
+import math
+import tempfile
+import shutil
+import queue
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# -------------------- CONFIGURATION VARIABLES --------------------
+# Those settings are set to my machine and to process very low res video. (about 640x480),
+# Using the settings below I get about 20 fps at this resolution using about 8gb of VRAM.
+# So you may want to play with the settings to find the sweet spot to your system.
+# For comparison basis, my system:
+# Ryzen 9 5950x
+# 64gb 3200 MT/s
+# RTX 3060 12gb (It's mostly bottle necked by GPU)
+# Windows 11 Pro Version 24H2 Build 26100.3194
+
+MAX_CONCURRENT_BATCHES = 5  # Number of extracted batches allowed in flight ahead of the GPU.
+# Extraction runs ahead of the ESRGAN stage and parks finished batches in
+# a queue; this bounds that queue so disk usage stays in check.
+# Depending on your system and your input video resolution, you may wanna lower this value.
+
+MODEL_NAME = "realesr-animevideov3-x2"  # Upscaler model to use with RealESRGAN.
+# If you change from x2 to 3x or 4x,
+# also change the ESRGAN_SCALE variable to
+# match the scale with the model.
+
+BATCH_SIZE = 20 # Batch size (in seconds). 0 = processes the whole video in one batch.
+# Note that if set to 0, the concurrent batches will only be one,
+# also if set to 0, make sure you have enough disk space since it'll
+# extract all the video frames before starts processing.
+# keeping it small it'll extract only what you defined at a time,
+# ideal if you don't have much space. Also if you set too large and
+# the video is short, it may not have enough batches to be processed
+# concurrently by the set value in concurrent batches...
+
+FINAL_FILE_FORMAT_OVERRIDE = "false" # Overrides final output file format.
+# Set to ".mp4" or any other file format to force that format,
+# or set to "false" to use the input file's format.
+
+# Variables for ESRGAN options:
+ESRGAN_SCALE = "2"  # Value for the -s option (scale)
+# This value must match the model upscaler multiplier
+# otherwise esrgan will assemble the video incorrectly.
+
+ESRGAN_TILE = "1920"  # Value for the -t option (tile size in esrgan)
+# Decrease this value to a divisible integer of the video resolution you're inputting
+# if you have problems with VRAM.
+
+FRAME_EXT = "jpg"  # Image format for the intermediate frames.
+# jpg encodes/decodes several times faster than png and writes a fraction
+# of the bytes to disk, which matters a lot since every frame is written
+# and read back twice per batch. Set to "png" if you want lossless
+# intermediates and don't mind the extra disk traffic.
+
+ESRGAN_EXTRA_ARGS = ""  # Additional ESRGAN arguments.
+# Only put add something here if you know what you're doing.
+
+USE_PIPE_BACKEND = False  # Experimental: run Real-ESRGAN in-process fed by ffmpeg pipes.
+# Streams raw frames decoder -> model -> encoder without any intermediate
+# image file ever touching disk. Needs the optional PyTorch stack
+# (pip install realesrgan) plus the matching .pth model in the models
+# folder, so it's off by default; realesrgan-ncnn-vulkan stays the
+# fallback whenever this is False.
+
+SCRATCH_DIR = ""  # Folder for the intermediate frame files.
+# Leave empty to auto-pick: /dev/shm (RAM-backed, so the frame churn never
+# hits the SSD) on Linux when available, otherwise the system temp folder.
+# On Windows point this at a RAM disk (e.g. an ImDisk drive) if you have
+# one - the frames are written once, read once and deleted, so they are
+# pure write amplification on a real disk.
+
+FFMPEG_REASSEMBLY_ARGS = "-c:v libx264 -pix_fmt yuv420p"  # Variable for ffmpeg arguments
+# Arguments for the final video encoding with ffmpeg.
+# Maybe you should leave as default if you don't know what you're doing.
+
+# ------------------------------------------------------------------
+
+def convert_if_needed(video_file, script_dir):
+    """
+    Batch extraction already retimes frames to integer fps via -r, so no
+    re-encoding pre-pass is needed here. Only remux (no re-encode) when the
+    container is not MP4, to keep -ss/-t batch seeking reliable.
+    Returns the path to the resulting file.
+    """
+    input_ext = os.path.splitext(video_file)[1].lower()
+    if input_ext == ".mp4":
+        return video_file
+
+    base_name = os.path.splitext(os.path.basename(video_file))[0]
+    temp_dir = tempfile.gettempdir()
+    converted_path = os.path.join(temp_dir, base_name + "_converted.mp4")
+    print(f"Remuxing from {input_ext} to .mp4 (no re-encode).")
+    cmd_remux = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-y",
+        "-i", video_file,
+        "-c", "copy",
+        converted_path
+    ]
+    subprocess.run(cmd_remux, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return converted_path
+
+
+def get_video_info(video_file):
+    """
+    Uses a single ffprobe call to get average frame rate, duration, and time_base.
+    Returns (fps, duration, time_base).
+    Falls back to format metadata when the stream carries no duration.
+    """
+    try:
+        cmd = [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=avg_frame_rate,duration,time_base:format=duration",
+            "-of", "json",
+            video_file
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        info = json.loads(result.stdout)
+        streams = info.get("streams") or []
+        if not streams:
+            raise ValueError("ffprobe reported no video stream.")
+        stream = streams[0]
+
+        def parse_ratio(value):
+            if '/' in value:
+                num, den = value.split('/')
+                return float(num) / float(den)
+            return float(value)
+
+        fps = parse_ratio(stream["avg_frame_rate"])
+        duration_str = stream.get("duration")
+        if duration_str in (None, "N/A"):
+            duration_str = info.get("format", {}).get("duration")
+        duration = float(duration_str)
+        time_base = parse_ratio(stream["time_base"])
+        return fps, duration, time_base
+    except Exception as e:
+        print(f"Error getting video info for {video_file}: {e}")
+        return 24.0, 0.0, 1.0 / 1000
+
+
+def create_placeholder_segment(batch_id, batch_index, duration, output_fps):
+    """
+    Generates a black placeholder segment for a batch that produced no usable frames,
+    so the final concat keeps the video timeline intact.
+    Returns the path to the placeholder, or None on failure.
+    """
+    temp_dir = tempfile.gettempdir()
+    placeholder_segment = os.path.join(temp_dir, batch_id + "_placeholder.mp4")
+    cmd_placeholder = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-y",
+        "-f", "lavfi",
+        "-i", f"color=c=black:s=1280x720:d={duration}",
+        "-r", str(output_fps),
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        placeholder_segment
+    ]
+    try:
+        subprocess.run(cmd_placeholder, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return placeholder_segment
+    except subprocess.CalledProcessError as e:
+        print(f"Error generating placeholder segment for batch {batch_index}: {e}")
+        return None
+
+
+def get_scratch_dir():
+    """
+    Returns the folder used for the intermediate frames: SCRATCH_DIR if set,
+    else /dev/shm when available (RAM-backed), else the regular temp folder.
+    """
+    if SCRATCH_DIR.strip() != "":
+        return SCRATCH_DIR
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def drop_page_cache(path):
+    """
+    Hints the kernel to evict a write-once file from the page cache so it
+    doesn't crowd out hot data while it waits to be read back. Linux only;
+    silently a no-op where posix_fadvise is unavailable (e.g. Windows).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def clear_frame_dir(directory):
+    """Deletes every file in a reusable working directory, keeping the directory itself."""
+    for entry in os.scandir(directory):
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def get_video_resolution(video_file):
+    """Uses ffprobe to get the width and height of the first video stream."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        video_file
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    width, height = (int(value) for value in result.stdout.split()[:2])
+    return width, height
+
+
+_pipe_upsampler = None
+_pipe_upsampler_lock = threading.Lock()
+
+
+def get_pipe_upsampler(script_dir):
+    """
+    Lazily builds the in-process RealESRGANer used by the pipe backend.
+    The PyTorch imports live here so the heavy stack is only needed when
+    USE_PIPE_BACKEND is actually enabled.
+    """
+    global _pipe_upsampler
+    with _pipe_upsampler_lock:
+        if _pipe_upsampler is None:
+            from basicsr.archs.srvgg_arch import SRVGGNetCompact
+            from realesrgan import RealESRGANer
+            scale = int(ESRGAN_SCALE)
+            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16,
+                                    upscale=scale, act_type='prelu')
+            model_path = os.path.join(script_dir, "models", MODEL_NAME + ".pth")
+            _pipe_upsampler = RealESRGANer(scale=scale, model_path=model_path, model=model,
+                                           tile=int(ESRGAN_TILE), tile_pad=10, pre_pad=0, half=True)
+    return _pipe_upsampler
+
+
+def process_batch_piped(video_file, batch_id, batch_index, start_time, duration, output_fps, script_dir,
+                        update_progress):
+    """
+    Fused pipe backend: decodes this batch's frames from ffmpeg as raw BGR24,
+    upscales them in-process and streams the result straight into the segment
+    encoder, so no intermediate frame ever hits the disk.
+    Returns the path to the segment (or a placeholder on failure).
+    """
+    import numpy as np
+
+    temp_dir = tempfile.gettempdir()
+    width, height = get_video_resolution(video_file)
+    scale = int(ESRGAN_SCALE)
+    upsampler = get_pipe_upsampler(script_dir)
+    segment_output = os.path.join(temp_dir, batch_id + "_segment.mp4")
+
+    cmd_decode = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-ss", str(start_time),
+        "-t", str(duration),
+        "-i", video_file,
+        "-r", str(output_fps),
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "pipe:1"
+    ]
+    cmd_encode = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-y",
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "-s", f"{width * scale}x{height * scale}",
+        "-r", str(output_fps),
+        "-i", "pipe:0"
+    ]
+    if FFMPEG_REASSEMBLY_ARGS.strip() != "":
+        cmd_encode.extend(FFMPEG_REASSEMBLY_ARGS.strip().split())
+    cmd_encode.append(segment_output)
+
+    frame_bytes = width * height * 3
+    frames_done = 0
+    decoder = subprocess.Popen(cmd_decode, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = subprocess.Popen(cmd_encode, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            raw = decoder.stdout.read(frame_bytes)
+            if not raw:
+                break
+            if len(raw) < frame_bytes:
+                print(f"Batch {batch_index}: truncated frame from decoder, stopping early.")
+                break
+            frame = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 3)
+            upscaled, _ = upsampler.enhance(frame, outscale=scale)
+            encoder.stdin.write(upscaled.tobytes())
+            frames_done += 1
+            update_progress(1)
+        encoder.stdin.close()
+        decoder.wait()
+        encoder.wait()
+    except Exception as e:
+        print(f"Pipe backend failed for batch {batch_index}: {e}")
+        for proc in (decoder, encoder):
+            if proc.poll() is None:
+                proc.kill()
+        return create_placeholder_segment(batch_id, batch_index, duration, output_fps)
+
+    if frames_done < 2 or encoder.returncode != 0:
+        print(f"Batch {batch_index}: pipe backend produced too few frames ({frames_done}). "
+              f"Creating placeholder segment.")
+        return create_placeholder_segment(batch_id, batch_index, duration, output_fps)
+    return segment_output
+
+
+def extract_batch(video_file, batch_index, start_time, duration, output_fps, extraction_dir):
+    """
+    Extraction stage: pulls this batch's frames out of the converted video
+    at output_fps into extraction_dir. Returns the number of frames extracted.
+    """
+    # Input-side -ss jumps to the nearest keyframe and decodes forward to the
+    # exact requested point; keeping -t on the output side then counts the
+    # decoded frames, and -vsync cfr pins them to the constant output rate so
+    # batch boundaries line up without dropped or duplicated frames.
+    cmd_extract = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-ss", str(start_time),
+        "-y",
+        "-i", video_file,
+        "-t", str(duration),
+        "-vsync", "cfr",
+        "-r", str(output_fps)
+    ]
+    if FRAME_EXT == "jpg":
+        cmd_extract.extend(["-q:v", "2"])  # High quality JPEG, still way cheaper than PNG.
+    cmd_extract.append(os.path.join(extraction_dir, "frame_%06d." + FRAME_EXT))
+    try:
+        subprocess.run(cmd_extract, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        print(f"Error extracting frames for batch {batch_index}: {e}")
+    return sum(1 for e in os.scandir(extraction_dir)
+               if e.name.startswith("frame_") and e.name.endswith("." + FRAME_EXT))
+
+
+def upscale_batch(extraction_dir, processed_dir, batch_index, script_dir, update_progress):
+    """
+    ESRGAN stage: runs RealESRGAN once on the extraction folder, reading its
+    verbose stderr for per-frame progress instead of polling the output
+    directory. Returns True on success.
+    """
+    realesrgan_bin = os.path.join(script_dir, "bin", "realesrgan-ncnn-vulkan")
+    # Build ESRGAN command with configurable options:
+    cmd_esrgan = [
+        realesrgan_bin,
+        "-i", extraction_dir,
+        "-o", processed_dir,
+        "-n", MODEL_NAME,
+        "-s", ESRGAN_SCALE,
+        "-t", ESRGAN_TILE,
+        "-f", FRAME_EXT,
+        "-v"  # Verbose: one "... done" line per finished frame.
+    ]
+    if ESRGAN_EXTRA_ARGS.strip() != "":
+        cmd_esrgan.extend(ESRGAN_EXTRA_ARGS.strip().split())
+    ESRGAN_TIMEOUT = 600 # Timeout in case some ESRGAN instance staggers.
+    max_attempts = 3
+    frames_reported = [0]  # Remembered across attempts so a retry doesn't double-count.
+
+    def read_progress(stream):
+        # One pipe read per completed frame instead of rescanning the output
+        # directory every 500 ms: O(1) per event and zero filesystem traffic.
+        seen = 0
+        for line in stream:
+            if "done" in line:
+                seen += 1
+                if seen > frames_reported[0]:
+                    frames_reported[0] = seen
+                    update_progress(1)
+
+    for attempt in range(1, max_attempts + 1):
+        proc = subprocess.Popen(cmd_esrgan, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, bufsize=1)
+        reader = threading.Thread(target=read_progress, args=(proc.stderr,))
+        reader.start()
+        try:
+            returncode = proc.wait(timeout=ESRGAN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            reader.join()
+            print(
+                f"Timeout: RealESRGAN for batch {batch_index} didn't finish in {ESRGAN_TIMEOUT}s, attempt {attempt}. Retrying...")
+            time.sleep(5)
+            continue
+        reader.join()
+        if returncode == 0:
+            return True
+        print(f"Error processing frames with RealESRGAN for batch {batch_index}, attempt {attempt}: "
+              f"exit code {returncode}")
+        time.sleep(5)
+
+    print(f"RealESRGAN failed for batch {batch_index} after {max_attempts} attempts. Creating placeholder segment.")
+    return False
+
+
+def reassemble_batch(processed_dir, batch_id, batch_index, duration, output_fps):
+    """
+    Reassembly stage: encodes the processed frames into a video segment by
+    reading them directly as an image sequence at a constant frame rate.
+    The caller clears and reuses the frame folder afterwards.
+    Returns the path to the segment.
+    """
+    temp_dir = tempfile.gettempdir()
+    frame_files = sorted(os.path.join(processed_dir, e.name) for e in os.scandir(processed_dir)
+                         if e.name.startswith("frame_") and e.name.endswith("." + FRAME_EXT))
+    if not frame_files:
+        print(f"No processed frames found for batch {batch_index}. Creating a placeholder segment.")
+        return create_placeholder_segment(batch_id, batch_index, duration, output_fps)
+    # ESRGAN keeps the zero-padded input names, so the frames normally already
+    # form a gapless frame_%06d sequence starting at 1. Only if a frame went
+    # missing do we renumber, so the image2 demuxer never stops early.
+    if os.path.basename(frame_files[-1]) != f"frame_{len(frame_files):06d}.{FRAME_EXT}":
+        for i, filepath in enumerate(frame_files, start=1):
+            target = os.path.join(processed_dir, f"frame_{i:06d}.{FRAME_EXT}")
+            if filepath != target:
+                os.rename(filepath, target)
+    segment_output = os.path.join(temp_dir, batch_id + "_segment.mp4")
+    cmd_assemble = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-framerate", str(output_fps),
+        "-i", os.path.join(processed_dir, "frame_%06d." + FRAME_EXT)
+    ]
+    if FFMPEG_REASSEMBLY_ARGS.strip() != "":
+        cmd_assemble.extend(FFMPEG_REASSEMBLY_ARGS.strip().split())
+    cmd_assemble.extend(["-y", segment_output])
+    try:
+        subprocess.run(cmd_assemble, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        print(f"Error reassembling video segment for batch {batch_index}: {e}")
+    # The segment sits untouched until the final concat at the end of the
+    # video; keep it from crowding the page cache in the meantime.
+    if os.path.exists(segment_output):
+        drop_page_cache(segment_output)
+    return segment_output
+
+
+def prep_video(video_file, script_dir):
+    """
+    Prep stage for one video: probes it and converts/remuxes only if needed.
+    Pure CPU/disk work, so main runs it for the next video while the current
+    one still owns the GPU.
+    Returns (converted_video, fps, duration, time_base), or None to skip.
+    """
+    print(f"\nPreparing video: {video_file}")
+    fps, duration, time_base = get_video_info(video_file)
+    if duration <= 0:
+        print(f"Skipping {video_file} due to zero duration.")
+        return None
+    converted_video = convert_if_needed(video_file, script_dir)
+    return converted_video, fps, duration, time_base
+
+
+def run_batches(video_file, converted_video, fps, duration, script_dir, video_index, total_videos):
+    """
+    GPU stage for one video: splits it into batches (in seconds defined by
+    BATCH_SIZE; 0 means all at once) and runs them through the three stage
+    conveyor (extract -> ESRGAN -> reassemble), or the pipe backend.
+    Returns the list of segment paths in batch order.
+    """
+    output_fps = int(round(fps))
+    total_frames = int(math.ceil(duration * output_fps))
+    if BATCH_SIZE == 0:
+        batch_duration = duration
+        num_batches = 1
+    else:
+        batch_duration = BATCH_SIZE
+        num_batches = math.ceil(duration / BATCH_SIZE)
+
+    progress_lock = threading.Lock()
+    frames_processed = [0]
+    batches_completed = [0]
+    start_time_progress = time.time()
+    progress_done = threading.Event()
+
+    def update_progress(delta):
+        with progress_lock:
+            frames_processed[0] += delta
+
+    def mark_batch_done():
+        with progress_lock:
+            batches_completed[0] += 1
+
+    def progress_bar():
+        # The invariant part of the line is built once, and ticks where no
+        # frame landed are skipped entirely - no string formatting and no
+        # flush syscall while the pipeline is stalled or ramping up.
+        prefix = f"\rVideo {video_index}/{total_videos} | "
+        last_current = -1
+        last_batches = -1
+        while not progress_done.is_set():
+            with progress_lock:
+                current = frames_processed[0]
+                batches = batches_completed[0]
+            if current != last_current or batches != last_batches:
+                last_current = current
+                last_batches = batches
+                elapsed = time.time() - start_time_progress
+                proc_fps = current / elapsed if elapsed > 0 else 0
+                percentage = (current / total_frames) * 100
+                remaining_frames = total_frames - current
+                eta_minutes = (remaining_frames / proc_fps) / 60 if proc_fps > 0 else float('inf')
+                print(
+                    prefix + f"Batches: {batches}/{num_batches} | Progress: {percentage:6.2f}% ({current}/{total_frames} frames) | Speed: {proc_fps:6.2f} fps | ETA: {eta_minutes:6.1f} min",
+                    end='', flush=True)
+            time.sleep(1)
+        with progress_lock:
+            current = frames_processed[0]
+            batches = batches_completed[0]
+        elapsed = time.time() - start_time_progress
+        proc_fps = current / elapsed if elapsed > 0 else 0
+        percentage = (current / total_frames) * 100
+        print(
+            f"\rVideo {video_index}/{total_videos} | Batches: {batches}/{num_batches} | Progress: {percentage:6.2f}% ({current}/{total_frames} frames) | Speed: {proc_fps:6.2f} fps | ETA: 0.0 min",
+            flush=True)
+
+    progress_thread = threading.Thread(target=progress_bar)
+    progress_thread.start()
+
+    temp_dir = tempfile.gettempdir()
+    segment_files = [None] * num_batches
+
+    if USE_PIPE_BACKEND:
+        # The pipe backend fuses extraction, upscaling and reassembly into one
+        # streaming pass and the in-process model already owns the GPU, so the
+        # batches simply run back to back.
+        base_name = os.path.splitext(os.path.basename(converted_video))[0]
+        for batch_index in range(num_batches):
+            start_time_batch = batch_index * batch_duration
+            current_duration = min(batch_duration, duration - start_time_batch)
+            batch_id = f"{base_name}_batch_{batch_index}_{int(time.time())}"
+            try:
+                segment_files[batch_index] = process_batch_piped(
+                    converted_video, batch_id, batch_index, start_time_batch, current_duration,
+                    output_fps, script_dir, update_progress)
+            except Exception as exc:
+                print(f"\nBatch {batch_index + 1} generated an exception: {exc}")
+            mark_batch_done()
+    else:
+        # Three stage conveyor: extraction and reassembly are cheap CPU/disk work
+        # that overlaps with inference, while the ESRGAN stage runs one batch at a
+        # time so a single process owns the GPU. The bounded queue keeps extraction
+        # from running away and filling the disk with frames.
+        extract_pool = ThreadPoolExecutor(max_workers=2)
+        # Reassembly runs in worker processes: the directory listing, sorting
+        # and renaming glue is pure Python that would otherwise serialize on
+        # the GIL against the progress bar and the other stages' threads.
+        # reassemble_batch takes only picklable paths/numbers, so it ships to
+        # a child process cleanly.
+        reassemble_pool = ProcessPoolExecutor(max_workers=2)
+        esrgan_queue = queue.Queue(maxsize=max(MAX_CONCURRENT_BATCHES, 1))
+        # Closed-loop stagger: a new batch starts extracting exactly when a
+        # previous one finishes its extraction, instead of a fixed sleep that
+        # either wastes time or lets extractions pile up.
+        stagger_sem = threading.Semaphore(max(MAX_CONCURRENT_BATCHES, 1))
+
+        scratch_dir = get_scratch_dir()
+        try:
+            # Rough upper bound on scratch usage: raw-sized input frames plus
+            # upscaled output frames for every batch that can be in flight.
+            width, height = get_video_resolution(converted_video)
+            scale = int(ESRGAN_SCALE)
+            est_batch_bytes = int(batch_duration * output_fps * width * height * 3 * (1 + scale * scale))
+            in_flight = max(MAX_CONCURRENT_BATCHES, 1) + 2
+            if shutil.disk_usage(scratch_dir).free < est_batch_bytes * in_flight:
+                print(f"Warning: scratch dir {scratch_dir} may be too small for {in_flight} batches in flight. "
+                      f"Lower BATCH_SIZE/MAX_CONCURRENT_BATCHES or point SCRATCH_DIR at a bigger volume.")
+        except Exception as e:
+            print(f"Could not check free space on scratch dir: {e}")
+
+        # Reuse a fixed pool of working directories instead of creating and
+        # rmtree-ing a fresh pair per batch: deleting hundreds of frame files
+        # plus the directory entries is surprisingly expensive (especially on
+        # NTFS), and reusing slots keeps the filesystem metadata warm. Files
+        # are truncated away in place when a slot is recycled. A couple of
+        # extra slots keep the conveyor full while batches sit in reassembly.
+        base_name = os.path.splitext(os.path.basename(converted_video))[0]
+        run_id = f"{base_name}_{int(time.time())}"
+        num_slots = max(MAX_CONCURRENT_BATCHES, 1) + 2
+        slot_dirs = []
+        slot_queue = queue.Queue()
+        for slot in range(num_slots):
+            slot_extract = os.path.join(scratch_dir, f"{run_id}_work_{slot}_extract")
+            slot_proc = os.path.join(scratch_dir, f"{run_id}_work_{slot}_proc")
+            os.makedirs(slot_extract, exist_ok=True)
+            os.makedirs(slot_proc, exist_ok=True)
+            slot_dirs.append((slot_extract, slot_proc))
+            slot_queue.put(slot)
+
+        def release_slot(slot):
+            extraction_dir, processed_dir = slot_dirs[slot]
+            clear_frame_dir(extraction_dir)
+            clear_frame_dir(processed_dir)
+            slot_queue.put(slot)
+
+        def extract_job(batch_index, batch_start, batch_len):
+            batch_id = f"{base_name}_batch_{batch_index}_{int(time.time())}"
+            slot = slot_queue.get()
+            extraction_dir, processed_dir = slot_dirs[slot]
+            try:
+                try:
+                    frame_count = extract_batch(converted_video, batch_index, batch_start, batch_len, output_fps,
+                                                extraction_dir)
+                finally:
+                    stagger_sem.release()  # Extraction slot is free, next batch may start.
+                if frame_count < 2:
+                    print(f"Batch {batch_index}: too few extracted frames ({frame_count}). Creating placeholder segment.")
+                    segment_files[batch_index] = create_placeholder_segment(batch_id, batch_index, batch_len, output_fps)
+                    release_slot(slot)
+                    update_progress(frame_count)
+                    mark_batch_done()
+                    return
+                esrgan_queue.put((batch_index, batch_id, slot, batch_len))
+            except Exception as exc:
+                # Anything unexpected (ffmpeg missing, bad scratch dir, ...)
+                # must still hand the slot back, or the fixed slot pool
+                # drains and later batches deadlock on slot_queue.get().
+                print(f"\nBatch {batch_index + 1} generated an exception: {exc}")
+                release_slot(slot)
+                mark_batch_done()
+
+        def esrgan_worker():
+            while True:
+                item = esrgan_queue.get()
+                if item is None:
+                    break
+                batch_index, batch_id, slot, batch_len = item
+                extraction_dir, processed_dir = slot_dirs[slot]
+                try:
+                    success = upscale_batch(extraction_dir, processed_dir, batch_index, script_dir, update_progress)
+                    clear_frame_dir(extraction_dir)
+                    if not success:
+                        segment_files[batch_index] = create_placeholder_segment(batch_id, batch_index, batch_len,
+                                                                                output_fps)
+                        release_slot(slot)
+                        mark_batch_done()
+                    else:
+                        future = reassemble_pool.submit(reassemble_batch, processed_dir, batch_id, batch_index,
+                                                        batch_len, output_fps)
+
+                        def on_reassembled(f, slot=slot):
+                            release_slot(slot)
+                            mark_batch_done()
+
+                        future.add_done_callback(on_reassembled)
+                        segment_files[batch_index] = future
+                except Exception as exc:
+                    print(f"\nBatch {batch_index + 1} generated an exception: {exc}")
+                    release_slot(slot)
+                    mark_batch_done()
+
+        esrgan_thread = threading.Thread(target=esrgan_worker)
+        esrgan_thread.start()
+
+        extract_futures = []
+        for batch_index in range(num_batches):
+            stagger_sem.acquire()  # Wait for an extraction slot to open up.
+            start_time_batch = batch_index * batch_duration
+            current_duration = min(batch_duration, duration - start_time_batch)
+            extract_futures.append(extract_pool.submit(extract_job, batch_index, start_time_batch, current_duration))
+
+        for future in extract_futures:
+            try:
+                future.result()
+            except Exception as exc:
+                print(f"\nBatch extraction generated an exception: {exc}")
+        esrgan_queue.put(None)
+        esrgan_thread.join()
+
+        # Resolve any pending reassembly futures into their segment paths.
+        for i, seg in enumerate(segment_files):
+            if isinstance(seg, Future):
+                try:
+                    segment_files[i] = seg.result()
+                except Exception as exc:
+                    print(f"\nBatch {i + 1} generated an exception: {exc}")
+                    segment_files[i] = None
+        extract_pool.shutdown()
+        reassemble_pool.shutdown()
+        for slot_extract, slot_proc in slot_dirs:
+            shutil.rmtree(slot_extract, ignore_errors=True)
+            shutil.rmtree(slot_proc, ignore_errors=True)
+
+    progress_done.set()
+    progress_thread.join()
+    return segment_files
+
+
+def finalize_video(video_file, converted_video, segment_files, script_dir, video_start_time):
+    """
+    Finalize stage for one video: concatenates the segments, merges the
+    original audio and metadata back in, and cleans up. Runs off the GPU
+    stage so the next video can start upscaling while this one is muxed.
+    Returns the elapsed wall-clock time for the video, or None on failure.
+    """
+    temp_dir = tempfile.gettempdir()
+    if converted_video != video_file and os.path.exists(converted_video):
+        os.remove(converted_video)
+
+    # Concatenate segments.
+    concat_list_file = os.path.join(temp_dir, f"{os.path.splitext(os.path.basename(video_file))[0]}_segments.txt")
+    lines = []
+    for seg in segment_files:
+        if seg is not None:
+            lines.append(f"file '{seg.replace('\\', '\\\\')}'\n")
+        else:
+            print("Warning: A batch segment is missing and will be skipped.")
+    with open(concat_list_file, "wb") as f:
+        f.write("".join(lines).encode("utf-8"))
+
+    # Determine final output file format.
+    if FINAL_FILE_FORMAT_OVERRIDE.lower() != "false":
+        final_ext = FINAL_FILE_FORMAT_OVERRIDE
+    else:
+        final_ext = os.path.splitext(video_file)[1]
+
+    output_dir = os.path.join(script_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(video_file))[0] + final_ext)
+    # Concatenate the segments and merge the original audio/metadata in one
+    # stream-copy pass, instead of writing an intermediate no-audio video
+    # and reading the whole thing back for the merge.
+    cmd_merge = [
+        "ffmpeg",
+        "-hide_banner", "-loglevel", "error",
+        "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", concat_list_file,
+        "-i", video_file,
+        "-map", "0:v",
+        "-map", "1:a",
+        "-c", "copy",
+        "-map_metadata", "1",
+        output_file
+    ]
+    try:
+        subprocess.run(cmd_merge, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        print(f"Error merging audio and video: {e}")
+        return
+
+    for seg in segment_files:
+        if seg and os.path.exists(seg):
+            os.remove(seg)
+    if os.path.exists(concat_list_file):
+        os.remove(concat_list_file)
+
+    video_elapsed = time.time() - video_start_time
+    minutes = int(video_elapsed // 60)
+    seconds = video_elapsed % 60
+    print(f"\nFinished processing {video_file}. Output saved to {output_file}")
+    print(f"Elapsed time for this video: {minutes} min {seconds:4.1f} sec\n")
+    return video_elapsed
+
+
+def main():
+    print("Script started!")
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    input_dir = os.path.join(script_dir, "input")
+    print(f"Looking for videos in: {input_dir}")
+
+    video_files = []
+    for root, dirs, files in os.walk(input_dir):
+        for file in files:
+            video_files.append(os.path.join(root, file))
+    total_videos = len(video_files)
+    if total_videos == 0:
+        print("No video files found in input folder.")
+        return
+
+    # Overlap the cheap stages of neighbouring videos with the GPU stage:
+    # while video N is upscaling, video N+1 is already probed/converted and
+    # video N-1 is concatenated/muxed in the background. The GPU itself stays
+    # serialized because run_batches is called from this loop, one at a time.
+    prep_pool = ThreadPoolExecutor(max_workers=1)
+    finalize_pool = ThreadPoolExecutor(max_workers=1)
+
+    def prep_job(video_path):
+        return time.time(), prep_video(video_path, script_dir)
+
+    finalize_futures = []
+    next_prep = prep_pool.submit(prep_job, video_files[0])
+    for i, video_path in enumerate(video_files, start=1):
+        print(f"\n--- Processing video {i}/{total_videos} ---")
+        try:
+            video_start_time, prep = next_prep.result()
+        except Exception as exc:
+            print(f"Error preparing {video_path}: {exc}")
+            prep = None
+        if i < total_videos:
+            next_prep = prep_pool.submit(prep_job, video_files[i])
+        if prep is None:
+            continue
+        converted_video, fps, duration, time_base = prep
+        segment_files = run_batches(video_path, converted_video, fps, duration, script_dir, i, total_videos)
+        finalize_futures.append(finalize_pool.submit(finalize_video, video_path, converted_video,
+                                                     segment_files, script_dir, video_start_time))
+
+    total_elapsed = 0
+    processed_videos = 0
+    for future in finalize_futures:
+        try:
+            elapsed = future.result()
+        except Exception as exc:
+            print(f"Error finalizing a video: {exc}")
+            continue
+        if elapsed is not None:
+            processed_videos += 1
+            total_elapsed += elapsed
+            print(f"Global progress: {processed_videos}/{total_videos} videos processed.")
+    prep_pool.shutdown()
+    finalize_pool.shutdown()
+    if processed_videos > 0:
+        total_minutes = int(total_elapsed // 60)
+        total_seconds = total_elapsed % 60
+        print(f"\nTotal elapsed time for all videos: {total_minutes} min {total_seconds:4.1f} sec")
+    else:
+        print("No videos were processed.")
+
+
+if __name__ == "__main__":
+    print("Running script...")
+    main()
+    print("Script completed!")